@@ -1,14 +1,13 @@
 import streamlit as st
 import pandas as pd
 import plotly.express as px
-from prophet import Prophet
-from prophet.plot import plot_plotly
-from prophet.diagnostics import cross_validation, performance_metrics
+import plotly.graph_objects as go
 import numpy as np 
 import warnings
 import logging
-from matplotlib import pyplot as plt
 import re
+import io
+import csv
 
 # Configurações iniciais
 st.set_page_config(page_title="Análise de Importação PMMA", layout="wide")
@@ -17,130 +16,284 @@ st.set_page_config(page_title="Análise de Importação PMMA", layout="wide")
 logging.getLogger('cmdstanpy').setLevel(logging.WARNING)
 warnings.filterwarnings("ignore", message="The behavior of DataFrame concatenation with empty or all-NA entries is deprecated")
 
-st.title("📊 Análise de Importação - PMMA")
+# --- Mapeamento de Colunas ---
+column_mapping = {
+    "Peso líquido": "Peso",
+    "VALOR FOB ESTIMADO TOTAL": "Valor_FOB",
+    "VALOR CIF TOTAL": "Valor_CIF",
+    "QTD Estatística": "Qtd_Estatística",
+    "Qtd. de operações estimada": "Qtd_Estatística",
+    "Descrição produto": "Descrição",
+    "PAIS DE ORIGEM": "País",
+    "PAÍS DE ORIGEM": "País",
+    "País de aquisição": "País_Aquisição",
+    "URF de Entrada": "URF_Entrada",
+    "PROVÁVEL IMPORTADOR": "Importador",
+    "PROVÁVEL EXPORTADOR": "Exportador",
+    "NCM's": "NCM",
+    "NCM": "NCM", 
+    "MODAL": "Modal",
+    "Incoterm": "Incoterm",
+    "Valor CIF Unitário": "CIF_Unitário",
+    "CIF Unitário": "CIF_Unitário",
+    "Valor FOB Estimado Unitário": "FOB_Unitário",
+}
 
-# --- Leitura do Arquivo (Suporte a Excel e CSV) ---
-uploaded_file = st.file_uploader("Carregue o arquivo de dados (Excel ou CSV)", type=["xlsx", "csv"])
-if uploaded_file:
-    file_extension = uploaded_file.name.split(".")[-1].lower()
-    df = pd.DataFrame()
-    
+# Máximo de linhas por gráfico na Análise Histórica; os demais grupos viram "Outros"
+max_chart_groups = 10
+
+# Colunas de origem usadas pelo app; as demais nem são carregadas da planilha
+source_cols = set(column_mapping) | {"ANO/MÊS"}
+
+numeric_cols = ["Peso", "Valor_FOB", "Valor_CIF", "Qtd_Estatística", "CIF_Unitário", "FOB_Unitário"]
+
+# Limpeza de números em texto: sempre remove espaços; com vírgula, o ponto é milhar
+# e a vírgula é decimal ("1.234,56" -> "1234.56")
+strip_spaces = str.maketrans({" ": None})
+decimal_comma = str.maketrans({" ": None, ".": None, ",": "."})
+
+# Colunas de texto com poucos valores distintos, guardadas como categóricas
+category_cols = ["NCM", "Descrição", "País", "País_Aquisição", "URF_Entrada", "Importador", "Exportador", "Modal", "Incoterm"]
+
+# --- Tratamento da data ---
+def yyyymm_to_datetime(n):
+    # Ano e mês saem por aritmética inteira, sem passar por string; só os 6 primeiros
+    # dígitos contam (ex.: 20230115 -> 2023-01)
+    n = np.floor(n)
+    n = n.where(n >= 100000)
+    n = n // 10 ** (np.floor(np.log10(n)) - 5)
+    year, month = n // 100, n % 100
+    # Fora do intervalo de datetime64[ns] ou com mês inválido vira NaT
+    valid = ((month >= 1) & (month <= 12) & (year >= 1678) & (year <= 2261)).to_numpy()
+    out = np.full(len(n), np.datetime64("NaT"), dtype="datetime64[ns]")
+    # Meses desde 1970-01 convertidos direto para datetime64, sem montar datas campo a campo
+    out[valid] = ((year[valid] - 1970) * 12 + month[valid] - 1).to_numpy(np.int64).astype("datetime64[M]")
+    return pd.Series(out, index=n.index)
+
+def parse_ano_mes(s):
+    if pd.api.types.is_datetime64_any_dtype(s):
+        return s
+    if pd.api.types.is_numeric_dtype(s):
+        return yyyymm_to_datetime(s.astype(float))
+
+    # Texto: valores com '-' ou '/' são datas; os demais, YYYYMM (com ou sem casas decimais)
+    txt = s.astype("string").str.strip()
+    has_sep = txt.str.contains(r"[-/]", regex=True).fillna(False).to_numpy(dtype=bool)
+    out = pd.Series(pd.NaT, index=s.index, dtype="datetime64[ns]")
+    if has_sep.any():
+        out[has_sep] = pd.to_datetime(txt[has_sep], format="mixed", errors='coerce')
+    digits = txt[~has_sep].str.split(".").str[0]
+    digits = digits.where(digits.str.fullmatch(r"\d{6,}").fillna(False))
+    out[~has_sep] = yyyymm_to_datetime(pd.to_numeric(digits).astype(float))
+    return out
+
+def is_source_col(col):
+    return str(col).strip() in source_cols
+
+# --- Leitura do Excel ---
+# O calamine (python-calamine) lê o XLSX em streaming, bem mais rápido e leve que o
+# openpyxl; se não estiver instalado, volta para o openpyxl.
+def read_excel_sheet(file_bytes, sheet_name):
     try:
-        if file_extension == "xlsx":
-            try:
-                df = pd.read_excel(uploaded_file, sheet_name="Sheet1")
-            except ValueError:
-                st.warning("A aba 'Sheet1' não foi encontrada. Lendo a primeira aba da planilha.")
-                df = pd.read_excel(uploaded_file, sheet_name=0)
-        elif file_extension == "csv":
-            df = pd.read_csv(uploaded_file, sep=None, engine='python', encoding='utf-8', on_bad_lines='skip')
-    except Exception as e:
-        st.error(f"Erro ao ler o arquivo: {e}")
-        st.stop()
+        return pd.read_excel(io.BytesIO(file_bytes), sheet_name=sheet_name, usecols=is_source_col, engine="calamine")
+    except ImportError:
+        return pd.read_excel(io.BytesIO(file_bytes), sheet_name=sheet_name, usecols=is_source_col, engine="openpyxl")
 
-    # --- Normalização e Mapeamento de Colunas ---
-    df.columns = [col.strip() for col in df.columns]
-
-    column_mapping = {
-        "Peso líquido": "Peso",
-        "VALOR FOB ESTIMADO TOTAL": "Valor_FOB",
-        "VALOR CIF TOTAL": "Valor_CIF",
-        "QTD Estatística": "Qtd_Estatística",
-        "Qtd. de operações estimada": "Qtd_Estatística",
-        "Descrição produto": "Descrição",
-        "PAIS DE ORIGEM": "País",
-        "PAÍS DE ORIGEM": "País",
-        "País de aquisição": "País_Aquisição",
-        "URF de Entrada": "URF_Entrada",
-        "PROVÁVEL IMPORTADOR": "Importador",
-        "PROVÁVEL EXPORTADOR": "Exportador",
-        "NCM's": "NCM",
-        "NCM": "NCM", 
-        "MODAL": "Modal",
-        "Incoterm": "Incoterm",
-        "Valor CIF Unitário": "CIF_Unitário",
-        "CIF Unitário": "CIF_Unitário",
-        "Valor FOB Estimado Unitário": "FOB_Unitário",
-    }
-    
-    renamed_cols = {k: v for k, v in column_mapping.items() if k in df.columns}
-
-    if "QTD Estatística" in df.columns and "Qtd. de operações estimada" in df.columns:
-        df.drop(columns=["QTD Estatística"], inplace=True)
-        if "QTD Estatística" in renamed_cols: del renamed_cols["QTD Estatística"]
-
-    df = df.rename(columns=renamed_cols)
-    if not df.empty:
-        df = df.loc[:, ~df.columns.duplicated(keep='first')]
-
-    # --- Tratamento da data ---
-    def safe_to_datetime(dt_val):
-        if pd.isna(dt_val): return pd.NaT
-        dt_str = str(dt_val).strip()
-        if '-' in dt_str or '/' in dt_str:
-            return pd.to_datetime(dt_str, errors='coerce')
+# --- Leitura do CSV ---
+# O separador é detectado uma vez no cabeçalho, o que permite usar o parser em C; o sep=None
+# exige o engine='python', muito mais lento. Só o cabeçalho, como faz o próprio pandas: nos dados,
+# as listas entre aspas simples da descrição enganam o Sniffer. Se a detecção falhar ou a coluna
+# ANO/MÊS não aparecer, volta para o comportamento antigo.
+def read_csv_file(file_bytes):
+    header = file_bytes[:65536].decode("utf-8", errors="ignore").split("\n", 1)[0]
+    try:
+        sep = csv.Sniffer().sniff(header, delimiters=";,\t|").delimiter
+        df = pd.read_csv(io.BytesIO(file_bytes), sep=sep, engine='c', encoding='utf-8', on_bad_lines='skip',
+                         usecols=is_source_col)
+        if any(str(col).strip() == "ANO/MÊS" for col in df.columns):
+            return df
+    except csv.Error:
+        pass
+    return pd.read_csv(io.BytesIO(file_bytes), sep=None, engine='python', encoding='utf-8', on_bad_lines='skip',
+                       usecols=is_source_col)
+
+# --- Leitura e Limpeza do Arquivo ---
+# Fica em cache pelo conteúdo do arquivo: cada interação com os widgets reexecuta o
+# script inteiro, e sem o cache a planilha seria lida e tratada de novo a cada clique.
+# O cache é gravado em disco, então sobrevive a reinícios do servidor.
+@st.cache_data(show_spinner="Processando planilha...", max_entries=4, persist="disk")
+def load_and_clean(file_bytes, file_name):
+    file_extension = file_name.split(".")[-1].lower()
+    df = pd.DataFrame()
+
+    if file_extension == "xlsx":
         try:
-            if '.' in dt_str: dt_str = dt_str.split('.')[0]
-            if dt_str.isdigit() and len(dt_str) >= 6:
-                return pd.to_datetime(dt_str[:6], format="%Y%m", errors='coerce')
-        except: pass
-        return pd.NaT
-    
-    if "ANO/MÊS" in df.columns:
-        df["ANO/MÊS"] = df["ANO/MÊS"].apply(safe_to_datetime)
-        df.dropna(subset=["ANO/MÊS"], inplace=True)
-    else:
-        st.error("Coluna 'ANO/MÊS' não encontrada.")
-        st.stop()
+            df = read_excel_sheet(file_bytes, "Sheet1")
+        except ValueError:
+            st.warning("A aba 'Sheet1' não foi encontrada. Lendo a primeira aba da planilha.")
+            df = read_excel_sheet(file_bytes, 0)
+    elif file_extension == "csv":
+        df = read_csv_file(file_bytes)
+
+    # --- Normalização e Mapeamento de Colunas ---
+    # Nomes finais calculados numa passada só. Quando duas colunas caem no mesmo nome, fica
+    # a primeira, exceto "Qtd. de operações estimada", que tem prioridade sobre "QTD Estatística"
+    source_names = [col.strip() for col in df.columns]
+    drop_qtd = "QTD Estatística" in source_names and "Qtd. de operações estimada" in source_names
+    keep, names, seen = [], [], set()
+    for i, col in enumerate(source_names):
+        name = column_mapping.get(col, col)
+        if name in seen or (drop_qtd and col == "QTD Estatística"):
+            continue
+        seen.add(name)
+        keep.append(i)
+        names.append(name)
+    if len(keep) < len(source_names):
+        df = df.iloc[:, keep]
+    df.columns = names
+
+    if "ANO/MÊS" not in df.columns:
+        raise KeyError("Coluna 'ANO/MÊS' não encontrada.")
+    df["ANO/MÊS"] = parse_ano_mes(df["ANO/MÊS"])
+    df.dropna(subset=["ANO/MÊS"], inplace=True)
+    # Ordenado uma vez aqui (mais recente primeiro); os filtros por máscara preservam a ordem,
+    # então a tabela de detalhamento não precisa reordenar a cada interação. O índice continua
+    # sendo o da linha original, que a tabela mostra para achar o registro na planilha
+    df.sort_values("ANO/MÊS", ascending=False, kind="stable", inplace=True)
 
     # --- Limpeza Numérica Robusta ---
-    numeric_cols = ["Peso", "Valor_FOB", "Valor_CIF", "Qtd_Estatística", "CIF_Unitário", "FOB_Unitário"]
     for col in numeric_cols:
         if col in df.columns:
-            if not pd.api.types.is_numeric_dtype(df[col]):
-                df[col] = df[col].astype(str).str.replace(" ", "", regex=False)
-                def clean_currency_string(val):
-                    if "," in val and "." in val:
-                        # Assume ponto como milhar e vírgula como decimal
-                        return val.replace(".", "").replace(",", ".")
-                    elif "," in val:
-                        return val.replace(",", ".")
-                    return val
-                df[col] = df[col].apply(clean_currency_string)
+            values = df[col]
+            if not pd.api.types.is_numeric_dtype(values):
+                values = values.astype(str)
+                has_comma = values.str.contains(",", regex=False)
+                values[has_comma] = values[has_comma].str.translate(decimal_comma)
+                values[~has_comma] = values[~has_comma].str.translate(strip_spaces)
+                values = pd.to_numeric(values, errors='coerce')
             
-            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(float)
+            # float32 basta para somas, gráficos e Prophet e usa metade da memória de float64
+            df[col] = values.fillna(0).astype(np.float32, copy=False)
 
     # --- Tratamento de NCM ---
     if "NCM" in df.columns:
         df["NCM"] = df["NCM"].apply(lambda x: str(int(float(x))) if pd.notna(x) and str(x).replace('.','',1).isdigit() else str(x))
 
+    for col in category_cols:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+
+    return df
+
+# --- Agregação Mensal ---
+# Sem cache: o st.cache_data teria de gerar o hash do DataFrame filtrado a cada interação,
+# o que custa tanto quanto o próprio groupby
+def aggregate_monthly(df, group_cols):
+    # sort=False evita ordenar a base inteira; a ordenação cronológica é feita no resultado, bem menor
+    sum_cols = [c for c in ["Peso", "Valor_CIF"] if c in df.columns]
+    return df.groupby(list(group_cols), observed=True, sort=False)[sum_cols].sum().reset_index().sort_values(
+        list(group_cols), ignore_index=True)
+
+# Série mensal para a previsão: o resample junta no mesmo mês datas completas (ex.: "2023-01-15")
+# que o groupby pela data exata separaria, e já sai em ordem cronológica. Sem cache, pelo
+# mesmo motivo da agregação acima
+def resample_monthly(df):
+    sum_cols = [c for c in ["Peso", "Valor_CIF"] if c in df.columns]
+    return df[["ANO/MÊS"] + sum_cols].set_index("ANO/MÊS").resample("MS").sum().reset_index()
+
+# --- Previsão (Prophet) ---
+# O ajuste do Prophet é a operação mais lenta do app. O modelo ajustado fica em cache
+# pela série de entrada, e a previsão pela série e pelo horizonte.
+@st.cache_resource(show_spinner=False, max_entries=8)
+def fit_prophet(df_p, uncertainty_samples):
+    from prophet import Prophet
+
+    # Série mensal: sazonalidades semanal e diária não se aplicam
+    m = Prophet(yearly_seasonality=True, weekly_seasonality=False, daily_seasonality=False, interval_width=0.95,
+                uncertainty_samples=uncertainty_samples)
+    m.fit(df_p)
+    return m
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def forecast_prophet(_m, df_p, uncertainty_samples, periods):
+    # Histórico + meses seguintes (início de mês), montados direto em vez do make_future_dataframe
+    history = df_p["ds"].to_numpy()
+    future_ds = pd.date_range(history[-1], periods=periods + 1, freq='MS')[1:]
+    future = pd.DataFrame({"ds": np.concatenate([history, future_ds.to_numpy()])})
+    return _m.predict(future)
+
+# A validação cruzada reajusta o modelo em cada janela; o resultado fica em cache pela série.
+# O MAPE só usa yhat, então o modelo sai sem amostras de incerteza e o slider não entra na chave
+@st.cache_data(show_spinner="Executando validação cruzada...", max_entries=8)
+def run_cv(df_p):
+    from prophet.diagnostics import cross_validation, performance_metrics
+
+    m = fit_prophet(df_p, 0)
+    # Cada janela roda o Stan num subprocesso, então threads bastam para paralelizar os ajustes
+    df_cv = cross_validation(m, initial='365 days', period='90 days', horizon='180 days', parallel="threads")
+    return performance_metrics(df_cv)
+
+# --- Filtros ---
+def isin_mask(s, values):
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        # Compara os códigos inteiros das categorias em vez de comparar strings linha a linha
+        selected = s.cat.categories.get_indexer(values)
+        return np.isin(s.cat.codes.to_numpy(), selected[selected >= 0])
+    return s.isin(values).to_numpy()
+
+def filter_options(s):
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        # As categorias já são os valores distintos, em ordem; basta ver quais códigos aparecem
+        codes = np.unique(s.cat.codes.to_numpy())
+        return s.cat.categories.take(codes[codes >= 0]).tolist()
+    return sorted(s.dropna().unique().tolist())
+
+st.title("📊 Análise de Importação - PMMA")
+
+# --- Leitura do Arquivo (Suporte a Excel e CSV) ---
+uploaded_file = st.file_uploader("Carregue o arquivo de dados (Excel ou CSV)", type=["xlsx", "csv"])
+if uploaded_file:
+    try:
+        df = load_and_clean(uploaded_file.getvalue(), uploaded_file.name)
+    except KeyError as e:
+        st.error(e.args[0])
+        st.stop()
+    except Exception as e:
+        st.error(f"Erro ao ler o arquivo: {e}")
+        st.stop()
+
     # =====================================================
     # 🔍 SEÇÃO DE FILTROS LATERAL
     # =====================================================
     st.sidebar.header("🔍 Filtros de Busca")
     
-    ncm_list = sorted(df["NCM"].dropna().unique().tolist()) if "NCM" in df.columns else []
+    ncm_list = filter_options(df["NCM"]) if "NCM" in df.columns else []
     ncm_default = [n for n in ncm_list if "39061000" in n]
     sel_ncm = st.sidebar.multiselect("Filtrar por NCM:", options=ncm_list, default=ncm_default)
     
-    df_filtrado = df.copy()
+    # Os filtros vão se acumulando numa única máscara; as opções de cada filtro saem das
+    # linhas que passaram pelos anteriores, e o DataFrame só é recortado uma vez, no final
+    mask = np.ones(len(df), dtype=bool)
     if sel_ncm:
-        df_filtrado = df_filtrado[df_filtrado["NCM"].isin(sel_ncm)]
+        mask &= isin_mask(df["NCM"], sel_ncm)
     
-    descricoes_list = sorted(df_filtrado["Descrição"].dropna().unique().tolist()) if "Descrição" in df_filtrado.columns else []
+    descricoes_list = filter_options(df.loc[mask, "Descrição"]) if "Descrição" in df.columns else []
     sel_descricoes = st.sidebar.multiselect("Filtrar por Descrição:", options=descricoes_list)
     if sel_descricoes:
-        df_filtrado = df_filtrado[df_filtrado["Descrição"].isin(sel_descricoes)]
+        mask &= isin_mask(df["Descrição"], sel_descricoes)
     
-    importadores_list = sorted(df_filtrado["Importador"].dropna().unique().tolist()) if "Importador" in df_filtrado.columns else []
+    importadores_list = filter_options(df.loc[mask, "Importador"]) if "Importador" in df.columns else []
     sel_importadores = st.sidebar.multiselect("Pesquisar Importadores:", options=importadores_list)
     if sel_importadores:
-        df_filtrado = df_filtrado[df_filtrado["Importador"].isin(sel_importadores)]
+        mask &= isin_mask(df["Importador"], sel_importadores)
 
-    exportadores_list = sorted(df_filtrado["Exportador"].dropna().unique().tolist()) if "Exportador" in df_filtrado.columns else []
+    exportadores_list = filter_options(df.loc[mask, "Exportador"]) if "Exportador" in df.columns else []
     sel_exportadores = st.sidebar.multiselect("Pesquisar Exportadores:", options=exportadores_list)
     if sel_exportadores:
-        df_filtrado = df_filtrado[df_filtrado["Exportador"].isin(sel_exportadores)]
+        mask &= isin_mask(df["Exportador"], sel_exportadores)
+
+    # Sem nenhum filtro ativo, usa o próprio df (só é lido daqui em diante) em vez de copiá-lo
+    df_filtrado = df if mask.all() else df[mask]
 
     st.sidebar.markdown("---")
     menu = st.sidebar.radio("Navegação:", ["Análise Histórica", "Previsão"])
@@ -157,10 +310,10 @@ if uploaded_file:
             col_f1, col_f2 = st.columns(2)
             with col_f1:
                 pais_col = "País" if "País" in df_filtrado.columns else "País_Aquisição"
-                paises_options = sorted(df_filtrado[pais_col].dropna().unique().tolist())
+                paises_options = filter_options(df_filtrado[pais_col])
                 sel_paises = st.multiselect("Filtrar por País de Origem:", paises_options)
                 if sel_paises:
-                    df_filtrado = df_filtrado[df_filtrado[pais_col].isin(sel_paises)]
+                    df_filtrado = df_filtrado[isin_mask(df_filtrado[pais_col], sel_paises)]
             
             with col_f2:
                 group_opts = ["Nenhum"] + [c for c in ["Descrição", "País", "Importador", "Exportador", "Modal", "Incoterm", "NCM"] if c in df_filtrado.columns]
@@ -171,24 +324,34 @@ if uploaded_file:
             if group_by_col != "Nenhum":
                 group_cols.append(group_by_col)
             
-            df_grouped = df_filtrado.groupby(group_cols).agg({
-                'Peso': 'sum',
-                'Valor_CIF': 'sum'
-            }).reset_index()
+            df_grouped = aggregate_monthly(df_filtrado, tuple(group_cols))
+
+            # Com muitos grupos, os gráficos mostram os maiores por peso e somam o resto em "Outros",
+            # para não mandar centenas de linhas ao navegador
+            category_orders = {}
+            if group_by_col != "Nenhum" and df_grouped[group_by_col].nunique() > max_chart_groups:
+                top = df_grouped.groupby(group_by_col, observed=True, sort=False)['Peso'].sum().nlargest(max_chart_groups).index
+                # "Outros" entra como última categoria, para ficar no fim da ordenação e da legenda
+                order = sorted(top) + ["Outros"]
+                labels = pd.Categorical(df_grouped[group_by_col].astype(object).where(df_grouped[group_by_col].isin(top), "Outros"),
+                                        categories=order)
+                df_grouped = df_grouped.assign(**{group_by_col: labels}).groupby(group_cols, observed=True, sort=False)[
+                    ['Peso', 'Valor_CIF']].sum().reset_index().sort_values(group_cols, ignore_index=True)
+                category_orders = {group_by_col: order}
             
-            df_grouped['CIF_Unitário'] = df_grouped.apply(
-                lambda row: row['Valor_CIF'] / row['Peso'] if row['Peso'] > 0 else 0, axis=1
-            )
+            peso = df_grouped['Peso'].to_numpy()
+            cif = df_grouped['Valor_CIF'].to_numpy()
+            df_grouped['CIF_Unitário'] = np.divide(cif, peso, out=np.zeros_like(cif), where=peso > 0)
 
             col_g1, col_g2 = st.columns(2)
             with col_g1:
                 fig_peso = px.line(df_grouped, x="ANO/MÊS", y="Peso", color=group_by_col if group_by_col != "Nenhum" else None,
-                                  title="Evolução de Peso Líquido (kg)", markers=True)
+                                  title="Evolução de Peso Líquido (kg)", markers=True, category_orders=category_orders)
                 st.plotly_chart(fig_peso, use_container_width=True)
 
             with col_g2:
                 fig_cif_u = px.line(df_grouped, x="ANO/MÊS", y="CIF_Unitário", color=group_by_col if group_by_col != "Nenhum" else None,
-                                   title="Evolução CIF Unitário (US$/kg)", markers=True)
+                                   title="Evolução CIF Unitário (US$/kg)", markers=True, category_orders=category_orders)
                 fig_cif_u.update_traces(hovertemplate="Data: %{x}<br>CIF Unitário: US$ %{y:.4f}/kg")
                 st.plotly_chart(fig_cif_u, use_container_width=True)
 
@@ -196,13 +359,15 @@ if uploaded_file:
             cols_show = ["ANO/MÊS", "NCM", "Descrição", "País", "Peso", "CIF_Unitário", "Importador", "Exportador"]
             cols_available = [c for c in cols_show if c in df_filtrado.columns]
             
-            df_display = df_filtrado[cols_available].sort_values("ANO/MÊS", ascending=False)
+            df_display = df_filtrado[cols_available]
+            # Formatação feita no navegador via column_config, sem o Styler percorrer cada célula em Python
             st.dataframe(
-                df_display.style.format({
-                    "CIF_Unitário": "US$ {:,.4f}",
-                    "Peso": "{:,.2f} kg"
-                }, decimal=',', thousands='.'), 
-                use_container_width=True
+                df_display,
+                use_container_width=True,
+                column_config={
+                    "CIF_Unitário": st.column_config.NumberColumn(format="US$ %.4f"),
+                    "Peso": st.column_config.NumberColumn(format="%.2f kg"),
+                },
             )
 
     # =====================================================
@@ -215,38 +380,50 @@ if uploaded_file:
             available_metrics = [m for m in ["CIF_Unitário", "Peso", "Valor_CIF"] if m in df_filtrado.columns]
             metrica = st.selectbox("Selecione a métrica para prever:", available_metrics, index=0)
             periods = st.slider("Meses para prever:", 1, 24, 6)
+            uncertainty_samples = st.slider("Amostras de incerteza (0 desativa o intervalo):", 0, 1000, 100, step=100)
 
             # Preparação do DataFrame para o Prophet
+            df_mensal = resample_monthly(df_filtrado)
             if metrica == "CIF_Unitário":
-                df_p = df_filtrado.groupby("ANO/MÊS").apply(
-                    lambda x: x['Valor_CIF'].sum() / x['Peso'].sum() if x['Peso'].sum() > 0 else 0
-                ).reset_index().rename(columns={"ANO/MÊS": "ds", 0: "y"})
+                # CIF unitário do mês = CIF total / peso total (0 nos meses sem peso)
+                peso = df_mensal["Peso"].to_numpy()
+                cif = df_mensal["Valor_CIF"].to_numpy()
+                y = np.divide(cif, peso, out=np.zeros_like(cif), where=peso > 0)
             else:
-                df_p = df_filtrado.groupby("ANO/MÊS")[metrica].sum().reset_index().rename(columns={"ANO/MÊS": "ds", metrica: "y"})
+                y = df_mensal[metrica].to_numpy()
+            df_p = pd.DataFrame({"ds": df_mensal["ANO/MÊS"].to_numpy(), "y": y})
             
             df_p = df_p[df_p['y'] > 0].sort_values("ds")
 
             if len(df_p) >= 2:
                 with st.spinner("Calculando previsão..."):
-                    m = Prophet(yearly_seasonality=True, interval_width=0.95)
-                    m.fit(df_p)
-                    future = m.make_future_dataframe(periods=periods, freq='MS')
-                    forecast = m.predict(future)
+                    m = fit_prophet(df_p, uncertainty_samples)
+                    forecast = forecast_prophet(m, df_p, uncertainty_samples, periods)
                     
-                    fig_forecast = plot_plotly(m, forecast)
+                    # Montado direto com graph_objects: o plot_plotly refaz fatias e concatenações da previsão
+                    hover = "Data: %{x}<br>Valor: %{y:.4f}"
+                    fig_forecast = go.Figure()
+                    if "yhat_lower" in forecast.columns:
+                        fig_forecast.add_scatter(x=forecast["ds"], y=forecast["yhat_upper"], mode="lines", line=dict(width=0),
+                                                 showlegend=False, hoverinfo="skip")
+                        fig_forecast.add_scatter(x=forecast["ds"], y=forecast["yhat_lower"], mode="lines", line=dict(width=0),
+                                                 fill="tonexty", fillcolor="rgba(0, 114, 178, 0.2)", name="Intervalo", hoverinfo="skip")
+                    fig_forecast.add_scatter(x=forecast["ds"], y=forecast["yhat"], mode="lines", line=dict(color="#0072B2", width=2),
+                                             name="Previsão", hovertemplate=hover)
+                    fig_forecast.add_scatter(x=df_p["ds"], y=df_p["y"], mode="markers", marker=dict(color="black", size=4),
+                                             name="Real", hovertemplate=hover)
                     unit_label = "US$/kg" if metrica == "CIF_Unitário" else ("kg" if metrica == "Peso" else "US$")
                     fig_forecast.update_layout(title=f"Previsão de {metrica} ({unit_label})", yaxis_title=unit_label, xaxis_title="Data")
-                    fig_forecast.update_traces(hovertemplate="Data: %{x}<br>Valor: %{y:.4f}")
                     
                     st.plotly_chart(fig_forecast, use_container_width=True)
                     
                     st.subheader("📊 Componentes da Tendência")
-                    st.pyplot(m.plot_components(forecast))
+                    from prophet.plot import plot_components_plotly
+                    st.plotly_chart(plot_components_plotly(m, forecast), use_container_width=True)
 
                     if st.checkbox("Mostrar Diagnóstico de Erro (MAPE)"):
                         try:
-                            df_cv = cross_validation(m, initial='365 days', period='90 days', horizon='180 days')
-                            df_perf = performance_metrics(df_cv)
+                            df_perf = run_cv(df_p)
                             st.write(f"Erro Médio (MAPE): {df_perf['mape'].mean() * 100:.2f}%")
                         except:
                             st.info("Dados insuficientes para validação estatística completa.")